@@ -1,15 +1,39 @@
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
 import pandas as pd
-import json
-from auth import init_firebase, register_coach, login_coach, send_password_reset
-from players import fetch_players, save_player, fetch_matches, save_match, delete_player, delete_match
+from auth import init_firebase, PerCallDatabase, register_coach, login_coach, send_password_reset
+from players import fetch_players, save_player, fetch_matches, save_match, delete_player, delete_match, clean_matches, summarize_matches
+from delivery import init_delivery
+from jobs import JobRunner
+from limits import RateLimiter, AdmissionGate, AdmissionMetrics, AdmissionController, RATE_LIMIT_DB_PATH, TRUSTED_PROXY_HOPS, AUTH_LIMITS, ACCOUNT_LIMITS, API_LIMITS
+from scoring import compute_efficiency, simulate_weights
+from versions import bump_data_version
+from similarity import find_similar_players
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'  # Change this in production
 
+# Deployment notes:
+# - Behind a reverse proxy (nginx, a PaaS router, ...) set TRUSTED_PROXY_HOPS to the number of
+#   proxies so rate limits see the real client IP instead of the proxy's.
+# - The admission gate needs a threaded worker class, e.g. `gunicorn --threads 8 app:app`.
+# - Jobs, rate-limit buckets and data versions live in local SQLite files next to this module,
+#   shared by all workers on the host.
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+# Compressed responses and fingerprinted, long-cached static assets
+init_delivery(app)
+
 # Initialize Firebase
 firebase = init_firebase()
-db = firebase.database()
+db = PerCallDatabase(firebase)
+
+# Background jobs for operations too slow to run inside a request
+job_runner = JobRunner(firebase.database)
+
+# Rate limiting and load shedding for routes that wait on Firebase
+admission = AdmissionController(RateLimiter(RATE_LIMIT_DB_PATH), AdmissionGate(), AdmissionMetrics(RATE_LIMIT_DB_PATH))
 
 @app.route('/')
 def index():
@@ -22,6 +46,7 @@ def login_page():
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@admission.guard('auth', AUTH_LIMITS, methods=('POST',))
 def register():
     if request.method == 'POST':
         data = request.get_json()
@@ -43,6 +68,7 @@ def register():
     return render_template('register.html')
 
 @app.route('/login', methods=['POST'])
+@admission.guard('auth', ACCOUNT_LIMITS)
 def login():
     data = request.get_json()
     email = data.get('email')
@@ -65,6 +91,7 @@ def login():
         return jsonify({'success': False, 'message': 'Invalid credentials'})
 
 @app.route('/forgot-password', methods=['POST'])
+@admission.guard('auth', ACCOUNT_LIMITS)
 def forgot_password():
     data = request.get_json()
     email = data.get('email')
@@ -81,6 +108,7 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
+@admission.guard('api', API_LIMITS)
 def dashboard():
     if 'logged_in' not in session or not session['logged_in']:
         return redirect(url_for('index'))
@@ -99,6 +127,7 @@ def dashboard():
                          players=players_data)
 
 @app.route('/api/players', methods=['GET'])
+@admission.guard('api', API_LIMITS)
 def get_players():
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -110,6 +139,7 @@ def get_players():
     return jsonify({'success': True, 'players': players_data})
 
 @app.route('/api/players', methods=['POST'])
+@admission.guard('api', API_LIMITS)
 def add_player():
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -123,18 +153,23 @@ def add_player():
         return jsonify({'success': False, 'message': 'Player name cannot be empty'})
     
     success, message = save_player(db, uid, name, role)
+    if success:
+        bump_data_version(uid, [name])
     return jsonify({'success': success, 'message': message})
 
 @app.route('/api/players/<player_name>', methods=['DELETE'])
+@admission.guard('api', API_LIMITS)
 def remove_player(player_name):
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
     
     uid = session['uid']
     delete_player(db, uid, player_name)
+    bump_data_version(uid, [player_name])
     return jsonify({'success': True, 'message': f'Player {player_name} deleted successfully'})
 
 @app.route('/api/players/<player_name>/update', methods=['POST'])
+@admission.guard('api', API_LIMITS)
 def update_player(player_name):
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -150,10 +185,12 @@ def update_player(player_name):
     # Delete old player and create new one with updated info
     delete_player(db, uid, player_name)
     success, message = save_player(db, uid, new_name, new_role)
+    bump_data_version(uid, [player_name, new_name])
     
     return jsonify({'success': success, 'message': 'Player updated successfully' if success else 'Error updating player'})
 
 @app.route('/api/matches/<player_name>', methods=['GET'])
+@admission.guard('api', API_LIMITS)
 def get_matches(player_name):
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -165,6 +202,7 @@ def get_matches(player_name):
     return jsonify({'success': True, 'matches': matches_data})
 
 @app.route('/api/matches', methods=['POST'])
+@admission.guard('api', API_LIMITS)
 def add_match():
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -189,6 +227,9 @@ def add_match():
     wickets = int(data.get('wickets', 0))
     catches = int(data.get('catches', 0))
     missed_catches = int(data.get('missed_catches', 0))
+    missed_catches_batsman = int(data.get('missed_catches_batsman', 0))
+    missed_catches_bowler = int(data.get('missed_catches_bowler', 0))
+    overthrows = int(data.get('overthrows', 0))
     misfields = int(data.get('misfields', 0))
     balls_faced = int(data.get('balls_faced', 0))
     fours = int(data.get('fours', 0))
@@ -201,68 +242,35 @@ def add_match():
     strike_rate = round((runs / balls_faced * 100), 2) if balls_faced > 0 else 0
     economy = round((runs_conceded / (balls_bowled / 6)), 2) if balls_bowled > 0 else 0
     
-    # Calculate efficiency based on role with improved formulas
-    if role == "Batsman":
-        # Emphasize batting stats for batsmen
-        efficiency = (
-            2.0 * runs +                    # Higher weight for runs
-            6.0 * fours +                   # Higher weight for boundaries
-            8.0 * sixes +                   # Higher weight for sixes
-            1.2 * strike_rate +             # Strong emphasis on strike rate
-            8.0 * catches +                 # Fielding contribution
-            12.0 * wickets +                # Bonus for bowling wickets
-            -3.0 * missed_catches +         # Penalty for missed catches
-            -2.0 * misfields +              # Penalty for misfields
-            -1.0 * dot_balls +              # Penalty for dot balls
-            -0.5 * economy +                # Minor penalty for economy (when bowling)
-            4.0 * missed_catches_batsman +  # Bonus for batsman when catches missed
-            -1.0 * missed_catches_bowler +  # Minor penalty when bowler affected by drops
-            -0.5 * overthrows               # Minor penalty for overthrows
-        )
-    elif role == "Bowler":
-        # Emphasize bowling stats for bowlers
-        efficiency = (
-            0.8 * runs +                    # Lower weight for batting runs
-            2.0 * fours +                   # Lower weight for batting boundaries
-            3.0 * sixes +                   # Lower weight for batting sixes
-            0.3 * strike_rate +             # Minor batting contribution
-            8.0 * catches +                 # Good fielding contribution
-            30.0 * wickets +                # Very high weight for wickets
-            -5.0 * missed_catches +         # Higher penalty for missed catches
-            -3.0 * misfields +              # Higher penalty for misfields
-            -0.5 * dot_balls +              # Minor penalty for dot balls when batting
-            -4.0 * economy +                # Strong penalty for high economy rate
-            -2.0 * missed_catches_batsman + # Penalty when batsman benefits from drops
-            -8.0 * missed_catches_bowler +  # Major penalty when bowler affected by drops
-            -3.0 * overthrows               # Penalty for overthrows conceded
-        )
-    else:  # All-Rounder
-        # Balanced weight for both batting and bowling
-        efficiency = (
-            1.5 * runs +                    # Balanced weight for runs
-            5.0 * fours +                   # Balanced weight for boundaries
-            6.0 * sixes +                   # Balanced weight for sixes
-            0.8 * strike_rate +             # Balanced strike rate importance
-            8.0 * catches +                 # Fielding contribution
-            22.0 * wickets +                # Balanced weight for wickets
-            -4.0 * missed_catches +         # Penalty for missed catches
-            -2.5 * misfields +              # Penalty for misfields
-            -0.8 * dot_balls +              # Penalty for dot balls
-            -2.5 * economy +                # Balanced penalty for economy
-            1.0 * missed_catches_batsman +  # Small bonus when batting benefits
-            -4.0 * missed_catches_bowler +  # Penalty when bowling affected by drops
-            -2.0 * overthrows               # Penalty for overthrows
-        )
+    # Calculate efficiency based on role
+    efficiency = compute_efficiency(role, {
+        "runs": runs,
+        "fours": fours,
+        "sixes": sixes,
+        "strike_rate": strike_rate,
+        "catches": catches,
+        "wickets": wickets,
+        "missed_catches": missed_catches,
+        "missed_catches_batsman": missed_catches_batsman,
+        "missed_catches_bowler": missed_catches_bowler,
+        "overthrows": overthrows,
+        "misfields": misfields,
+        "dot_balls": dot_balls,
+        "economy": economy
+    })
     
     success, message = save_match(db, uid, player_name, match_id, 
-                                runs, wickets, catches, missed_catches, misfields,
-                                missed_catches_batsman, missed_catches_bowler, overthrows,
+                                runs, wickets, catches, missed_catches,
+                                missed_catches_batsman, missed_catches_bowler, overthrows, misfields,
                                 balls_faced, fours, sixes, balls_bowled, dot_balls, 
                                 runs_conceded, strike_rate, economy, efficiency)
+    if success:
+        bump_data_version(uid, [player_name])
     
     return jsonify({'success': success, 'message': message})
 
 @app.route('/api/matches/<player_name>/<match_id>', methods=['PUT'])
+@admission.guard('api', API_LIMITS)
 def update_match(player_name, match_id):
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -297,58 +305,22 @@ def update_match(player_name, match_id):
     strike_rate = round((runs / balls_faced * 100), 2) if balls_faced > 0 else 0
     economy = round((runs_conceded / (balls_bowled / 6)), 2) if balls_bowled > 0 else 0
     
-    # Calculate efficiency based on role with improved formulas
-    if role == "Batsman":
-        # Emphasize batting stats for batsmen
-        efficiency = (
-            2.0 * runs +                    # Higher weight for runs
-            6.0 * fours +                   # Higher weight for boundaries
-            8.0 * sixes +                   # Higher weight for sixes
-            1.2 * strike_rate +             # Strong emphasis on strike rate
-            8.0 * catches +                 # Fielding contribution
-            12.0 * wickets +                # Bonus for bowling wickets
-            -3.0 * missed_catches +         # Penalty for missed catches
-            -4.0 * missed_catches_batsman + # Higher penalty for batsman perspective missed catches
-            -2.0 * missed_catches_bowler +  # Lower penalty for bowler perspective missed catches
-            -3.0 * overthrows +             # Penalty for overthrows
-            -2.0 * misfields +              # Penalty for misfields
-            -1.0 * dot_balls +              # Penalty for dot balls
-            -0.5 * economy                  # Minor penalty for economy (when bowling)
-        )
-    elif role == "Bowler":
-        # Emphasize bowling stats for bowlers
-        efficiency = (
-            0.8 * runs +                    # Lower weight for batting runs
-            2.0 * fours +                   # Lower weight for batting boundaries
-            3.0 * sixes +                   # Lower weight for batting sixes
-            0.3 * strike_rate +             # Minor batting contribution
-            8.0 * catches +                 # Good fielding contribution
-            30.0 * wickets +                # Very high weight for wickets
-            -5.0 * missed_catches +         # Higher penalty for missed catches
-            -2.0 * missed_catches_batsman + # Lower penalty for batsman perspective missed catches
-            -6.0 * missed_catches_bowler +  # Higher penalty for bowler perspective missed catches
-            -5.0 * overthrows +             # Higher penalty for overthrows (bowling perspective)
-            -3.0 * misfields +              # Higher penalty for misfields
-            -0.5 * dot_balls +              # Minor penalty for dot balls when batting
-            -4.0 * economy                  # Strong penalty for high economy rate
-        )
-    else:  # All-Rounder
-        # Balanced weight for both batting and bowling
-        efficiency = (
-            1.5 * runs +                    # Balanced weight for runs
-            5.0 * fours +                   # Balanced weight for boundaries
-            6.0 * sixes +                   # Balanced weight for sixes
-            0.8 * strike_rate +             # Balanced strike rate importance
-            8.0 * catches +                 # Fielding contribution
-            22.0 * wickets +                # Balanced weight for wickets
-            -4.0 * missed_catches +         # Penalty for missed catches
-            -3.0 * missed_catches_batsman + # Balanced penalty for batsman perspective missed catches
-            -4.0 * missed_catches_bowler +  # Balanced penalty for bowler perspective missed catches
-            -4.0 * overthrows +             # Balanced penalty for overthrows
-            -2.5 * misfields +              # Penalty for misfields
-            -0.8 * dot_balls +              # Penalty for dot balls
-            -2.5 * economy                  # Balanced penalty for economy
-        )
+    # Calculate efficiency based on role
+    efficiency = compute_efficiency(role, {
+        "runs": runs,
+        "fours": fours,
+        "sixes": sixes,
+        "strike_rate": strike_rate,
+        "catches": catches,
+        "wickets": wickets,
+        "missed_catches": missed_catches,
+        "missed_catches_batsman": missed_catches_batsman,
+        "missed_catches_bowler": missed_catches_bowler,
+        "overthrows": overthrows,
+        "misfields": misfields,
+        "dot_balls": dot_balls,
+        "economy": economy
+    })
     
     # Update the match record
     match_data = {
@@ -373,59 +345,110 @@ def update_match(player_name, match_id):
     
     db.child("coach_data").child(uid).child("players").child(player_name).child("matches").child(match_id).set(match_data)
     
-    # Recalculate player totals from all matches (similar to save_match function)
-    from players import save_match
-    # We'll use the existing logic from players.py by calling a helper function
-    # For now, let's implement the recalculation here
+    # Recalculate player totals from all matches
     all_matches = db.child("coach_data").child(uid).child("players").child(player_name).child("matches").get().val()
-    if isinstance(all_matches, list):
-        all_matches = {str(i): match for i, match in enumerate(all_matches)}
-
-    valid_matches = []
-    for m in all_matches.values():
-        if isinstance(m, str):
-            try:
-                m = json.loads(m.replace("'", "\""))
-            except:
-                continue
-        if isinstance(m, dict):
-            valid_matches.append(m)
-
-    total_eff = sum(m.get("efficiency", 0) for m in valid_matches)
-    total_runs = sum(m.get("runs", 0) for m in valid_matches)
-    total_wickets = sum(m.get("wickets", 0) for m in valid_matches)
-    total_catches = sum(m.get("catches", 0) for m in valid_matches)
-    total_missed_catches = sum(m.get("missed_catches", 0) for m in valid_matches)
-    total_missed_catches_batsman = sum(m.get("missed_catches_batsman", 0) for m in valid_matches)
-    total_missed_catches_bowler = sum(m.get("missed_catches_bowler", 0) for m in valid_matches)
-    total_overthrows = sum(m.get("overthrows", 0) for m in valid_matches)
-    total_misfields = sum(m.get("misfields", 0) for m in valid_matches)
-    avg_eff = total_eff / len(valid_matches) if valid_matches else 0
-
-    db.child("coach_data").child(uid).child("players").child(player_name).update({
-        "efficiency": round(avg_eff, 2),
-        "total_runs": total_runs,
-        "total_wickets": total_wickets,
-        "total_catches": total_catches,
-        "total_missed_catches": total_missed_catches,
-        "total_missed_catches_batsman": total_missed_catches_batsman,
-        "total_missed_catches_bowler": total_missed_catches_bowler,
-        "total_overthrows": total_overthrows,
-        "total_misfields": total_misfields
-    })
+    valid_matches = list(clean_matches(all_matches).values())
+    db.child("coach_data").child(uid).child("players").child(player_name).update(summarize_matches(valid_matches))
+    bump_data_version(uid, [player_name])
     
     return jsonify({'success': True, 'message': 'Match updated successfully'})
 
 @app.route('/api/matches/<player_name>/<match_id>', methods=['DELETE'])
+@admission.guard('api', API_LIMITS)
 def remove_match(player_name, match_id):
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
     
     uid = session['uid']
     delete_match(db, uid, player_name, match_id)
+    bump_data_version(uid, [player_name])
     return jsonify({'success': True, 'message': 'Match deleted successfully'})
 
+@app.route('/api/players/<player_name>/similar', methods=['GET'])
+@admission.guard('api', API_LIMITS)
+def similar_players(player_name):
+    if 'logged_in' not in session or not session['logged_in']:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    uid = session['uid']
+    try:
+        k = int(request.args.get('k', 5))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'k must be an integer'})
+    if k < 1:
+        return jsonify({'success': False, 'message': 'k must be at least 1'})
+    role = request.args.get('role') or None
+    
+    similar = find_similar_players(db, uid, player_name, k, role)
+    if similar is None:
+        return jsonify({'success': False, 'message': 'Player not found'})
+    
+    return jsonify({'success': True, 'player': player_name, 'similar': similar})
+
+@app.route('/api/simulate-weights', methods=['POST'])
+@admission.guard('api', API_LIMITS)
+def simulate_efficiency_weights():
+    if 'logged_in' not in session or not session['logged_in']:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    data = request.get_json() or {}
+    uid = session['uid']
+    
+    result, error = simulate_weights(db, uid, data.get('weights', {}))
+    if error:
+        return jsonify({'success': False, 'message': error})
+    
+    return jsonify({'success': True, **result})
+
+@app.route('/api/jobs', methods=['POST'])
+@admission.guard('api', API_LIMITS)
+def submit_job():
+    if 'logged_in' not in session or not session['logged_in']:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    data = request.get_json() or {}
+    uid = session['uid']
+    
+    job, error = job_runner.submit(uid, data.get('type'), data.get('params'))
+    if error:
+        return jsonify({'success': False, 'message': error})
+    
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs', methods=['GET'])
+@admission.guard('api', API_LIMITS)
+def list_jobs():
+    if 'logged_in' not in session or not session['logged_in']:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    uid = session['uid']
+    return jsonify({'success': True, 'jobs': job_runner.list(uid)})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@admission.guard('api', API_LIMITS)
+def get_job(job_id):
+    if 'logged_in' not in session or not session['logged_in']:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    uid = session['uid']
+    job = job_runner.get(uid, job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'})
+    
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@admission.guard('api', API_LIMITS)
+def cancel_job(job_id):
+    if 'logged_in' not in session or not session['logged_in']:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    uid = session['uid']
+    success, message = job_runner.cancel(uid, job_id)
+    return jsonify({'success': success, 'message': message})
+
 @app.route('/api/team-results')
+@admission.guard('api', API_LIMITS)
 def team_results():
     if 'logged_in' not in session or not session['logged_in']:
         return jsonify({'success': False, 'message': 'Not authenticated'})
@@ -463,5 +486,13 @@ def team_results():
     
     return jsonify({'success': True, 'players': players_list})
 
+@app.route('/api/admission-metrics')
+@admission.guard('api', API_LIMITS)
+def admission_metrics():
+    if 'logged_in' not in session or not session['logged_in']:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    return jsonify({'success': True, 'metrics': admission.snapshot()})
+
 if __name__ == '__main__':
     app.run(debug=True)
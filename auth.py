@@ -16,6 +16,16 @@ def init_firebase():
     firebase = pyrebase.initialize_app(firebaseConfig)
     return firebase
 
+# pyrebase's Database.child() appends to path state held on the Database object itself, so
+# one Database shared between threads can send a read or write to the wrong key. This hands
+# every db.child(...) chain a fresh Database, making a module-level db safe under --threads.
+class PerCallDatabase:
+    def __init__(self, firebase):
+        self.firebase = firebase
+
+    def child(self, *args):
+        return self.firebase.database().child(*args)
+
 def register_coach(firebase, username, email, team, password):
     try:
         auth = firebase.auth()
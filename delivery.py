@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from flask import request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024            # Bytes; smaller bodies aren't worth the CPU
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'image/svg+xml')
+STATIC_MAX_AGE = 365 * 24 * 3600    # Fingerprinted assets never change under the same URL
+
+
+def _compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+def _encodings():
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+def _compress(data, encoding, static=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else 5)
+    return gzip.compress(data, compresslevel=9 if static else 6)
+
+
+# url(...) in CSS, quoted or not; the quoted forms may contain parentheses (e.g. data: SVGs)
+CSS_URL = re.compile(r"""url\(\s*(?:'([^']*)'|"([^"]*)"|([^'")\s]+))\s*\)""")
+URL_SCHEME = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*:')
+
+def _hash_name(rel, data):
+    base, ext = os.path.splitext(rel)
+    return f"{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+# Point relative url() references in a stylesheet at the referenced files' hashed names,
+# keeping them relative so they still resolve from the stylesheet's own hashed URL
+def rewrite_css_urls(css, rel, manifest):
+    folder = posixpath.dirname(rel)
+
+    def replace(match):
+        url = next(g for g in match.groups() if g is not None)
+        if not url or URL_SCHEME.match(url) or url.startswith(('/', '#')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(folder, path))
+        if target not in manifest:
+            return match.group(0)
+        hashed = path[:len(path) - len(posixpath.basename(path))] + posixpath.basename(manifest[target])
+        return f"url('{hashed}{suffix}')"
+
+    return CSS_URL.sub(replace, css.decode('utf-8')).encode('utf-8')
+
+# Map every file under the static folder to a content-hashed name, e.g.
+# 'js/dashboard.js' -> 'js/dashboard.3f9c1a2b7d4e.js'. Stylesheets are hashed after their
+# url() references are rewritten, so an image change gives the CSS a new URL too; returns
+# (manifest, {rel: rewritten stylesheet bytes}). url() references between stylesheets are
+# left pointing at the unhashed files.
+def build_manifest(static_folder):
+    manifest = {}
+    stylesheets = {}
+    for root, _, files in os.walk(static_folder):
+        for filename in files:
+            path = os.path.join(root, filename)
+            with open(path, 'rb') as f:
+                data = f.read()
+            rel = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if rel.endswith('.css'):
+                stylesheets[rel] = data
+            else:
+                manifest[rel] = _hash_name(rel, data)
+
+    rewritten = {}
+    for rel, data in stylesheets.items():
+        rewritten[rel] = rewrite_css_urls(data, rel, manifest)
+        manifest[rel] = _hash_name(rel, rewritten[rel])
+    return manifest, rewritten
+
+
+class StaticAssets:
+    # Serves fingerprinted static files with immutable cache headers, keeping a
+    # precompressed copy of each text asset in memory
+    def __init__(self, app):
+        self.app = app
+        self.manifest, self.rewritten = build_manifest(app.static_folder)
+        self.originals = {hashed: rel for rel, hashed in self.manifest.items()}
+        self.compressed = {}
+        self.lock = threading.Lock()
+
+        app.url_defaults(self.fingerprint_url)
+        app.view_functions['static'] = self.serve
+
+    # url_for('static', filename='css/style.css') -> /static/css/style.<hash>.css in every template
+    def fingerprint_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def _read(self, rel):
+        if rel in self.rewritten:
+            return self.rewritten[rel]
+        with open(os.path.join(self.app.static_folder, rel), 'rb') as f:
+            return f.read()
+
+    def _precompressed(self, rel, encoding):
+        key = (rel, encoding)
+        with self.lock:
+            data = self.compressed.get(key)
+        if data is None:
+            data = _compress(self._read(rel), encoding, static=True)
+            with self.lock:
+                self.compressed[key] = data
+        return data
+
+    def serve(self, filename):
+        rel = self.originals.get(filename)
+        if rel is None:
+            # Unhashed URLs (e.g. url() references between stylesheets) keep Flask's default revalidating headers
+            return self.app.send_static_file(filename)
+
+        mimetype = mimetypes.guess_type(rel)[0]
+        encoding = request.accept_encodings.best_match(_encodings()) if _compressible(mimetype) else None
+        if encoding:
+            response = Response(self._precompressed(rel, encoding), mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(f"{filename}-{encoding}")
+        elif rel in self.rewritten:
+            response = Response(self.rewritten[rel], mimetype=mimetype)
+            response.set_etag(filename)
+        else:
+            response = self.app.send_static_file(rel)
+            response.set_etag(filename)
+        if _compressible(mimetype):
+            response.vary.add('Accept-Encoding')
+
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+
+
+# Compress JSON and text responses above COMPRESS_MIN_SIZE with the best encoding the client accepts
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or not 200 <= response.status_code < 300
+            or not _compressible(response.mimetype)):
+        return response
+
+    encoding = request.accept_encodings.best_match(_encodings())
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if not encoding or len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(_compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_delivery(app):
+    assets = StaticAssets(app)
+    app.after_request(compress_response)
+    return assets
@@ -0,0 +1,375 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from players import clean_matches, summarize_matches
+from scoring import compute_efficiency
+from versions import bump_data_version
+
+JOBS_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite3')
+MAX_WORKERS = 2         # Jobs run at once by each app process
+PER_COACH_LIMIT = 1     # Jobs run at once per coach, across all processes sharing the queue
+POLL_INTERVAL = 5       # Seconds between checks for work queued by other processes
+LEASE_SECONDS = 60      # A running job whose owner hasn't heartbeated for this long is requeued
+RETENTION_DAYS = 7      # Finished jobs (and their results) are deleted after this long
+KEEP_FINISHED_PER_COACH = 20    # ...and only the most recent ones are kept per coach
+PRUNE_INTERVAL = 600    # Seconds between retention sweeps
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    # Handed to a running job so it can report progress and notice cancellation
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.job_id = job_id
+
+    def progress(self, fraction, message=None):
+        conn = self.runner._connect()
+        try:
+            cur = conn.execute("UPDATE jobs SET progress = ?, message = ?, heartbeat_at = ? WHERE id = ? AND owner = ?",
+                               (round(min(max(fraction, 0.0), 1.0), 4), message, time.time(),
+                                self.job_id, self.runner.owner))
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.job_id,)).fetchone()
+        finally:
+            conn.close()
+        # Losing the lease means the job was requeued elsewhere; stop rather than run it twice
+        if not cur.rowcount or (row and row['cancel_requested']):
+            raise JobCancelled()
+
+
+class JobRunner:
+    # Thread pool fed from a SQLite-backed queue, so jobs and their results survive restarts.
+    # `db_factory` (e.g. firebase.database) builds a fresh pyrebase Database for each job:
+    # Database.child() mutates shared path state, so one must never be used from two threads.
+    def __init__(self, db_factory, path=JOBS_DB_PATH, max_workers=MAX_WORKERS, per_coach_limit=PER_COACH_LIMIT):
+        self.db_factory = db_factory
+        self.path = path
+        self.max_workers = max_workers
+        self.per_coach_limit = per_coach_limit
+        # Random per instance: hostnames and pids are reused across container restarts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cricscore-job')
+        self.lock = threading.Lock()
+        self.active = 0
+
+        self._init_db()
+        self._recover()
+        threading.Thread(target=self._poll, name='cricscore-job-poll', daemon=True).start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    uid TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    params TEXT,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    heartbeat_at REAL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'heartbeat_at' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_uid_created ON jobs (uid, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        finally:
+            conn.close()
+
+    # Requeue running jobs whose owner stopped heartbeating, whatever host or process it was
+    def _recover(self):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                UPDATE jobs SET status = 'queued', progress = 0, message = 'Requeued after its worker stopped',
+                    owner = NULL, heartbeat_at = NULL, cancel_requested = 0
+                WHERE status = 'running' AND owner IS NOT ? AND COALESCE(heartbeat_at, started_at, 0) < ?
+            """, (self.owner, time.time() - LEASE_SECONDS))
+        finally:
+            conn.close()
+
+    # Keep the lease on every job this instance is running, even during a long Firebase call
+    def _heartbeat(self):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND owner = ?",
+                         (time.time(), self.owner))
+        finally:
+            conn.close()
+
+    # Drop old finished jobs so exported results don't grow the queue database without bound
+    def _prune(self):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?",
+                         (time.time() - RETENTION_DAYS * 24 * 3600,))
+            conn.execute("""
+                DELETE FROM jobs WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY uid ORDER BY created_at DESC) AS n
+                        FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled')
+                    ) WHERE n > ?
+                )
+            """, (KEEP_FINISHED_PER_COACH,))
+        finally:
+            conn.close()
+
+    def _poll(self):
+        last_prune = 0
+        while True:
+            time.sleep(POLL_INTERVAL)
+            try:
+                self._heartbeat()
+                self._recover()
+                self._dispatch()
+                if time.time() - last_prune >= PRUNE_INTERVAL:
+                    self._prune()
+                    last_prune = time.time()
+            except sqlite3.Error as e:
+                print(f"Job poll failed: {e}")
+
+    # Atomically move the oldest eligible queued job to running; returns its id or None
+    def _claim(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            running = dict(conn.execute(
+                "SELECT uid, COUNT(*) FROM jobs WHERE status = 'running' GROUP BY uid").fetchall())
+            for row in conn.execute("SELECT id, uid FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall():
+                if running.get(row['uid'], 0) < self.per_coach_limit:
+                    now = time.time()
+                    conn.execute("UPDATE jobs SET status = 'running', owner = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                                 (self.owner, now, now, row['id']))
+                    conn.execute("COMMIT")
+                    return row['id']
+            conn.execute("COMMIT")
+            return None
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _dispatch(self):
+        with self.lock:
+            while self.active < self.max_workers:
+                job_id = self._claim()
+                if job_id is None:
+                    break
+                self.active += 1
+                self.executor.submit(self._run, job_id)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?,
+                    progress = CASE WHEN ? = 'succeeded' THEN 1 ELSE progress END
+                WHERE id = ? AND owner = ?
+            """, (status, json.dumps(result) if result is not None else None, error, time.time(), status,
+                  job_id, self.owner))
+        finally:
+            conn.close()
+
+    def _run(self, job_id):
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT uid, type, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            finally:
+                conn.close()
+
+            try:
+                handler = JOB_TYPES[row['type']]
+                result = handler(self.db_factory(), row['uid'], json.loads(row['params'] or '{}'), JobContext(self, job_id))
+                self._finish(job_id, 'succeeded', result=result)
+            except JobCancelled:
+                self._finish(job_id, 'cancelled')
+            except Exception as e:
+                self._finish(job_id, 'failed', error=str(e))
+        finally:
+            with self.lock:
+                self.active -= 1
+            self._dispatch()
+
+    # Queue a job for a coach; returns (job, error_message)
+    def submit(self, uid, job_type, params=None):
+        if job_type not in JOB_TYPES:
+            return None, f"Unknown job type: {job_type}"
+        if params is not None and not isinstance(params, dict):
+            return None, "Job params must be an object"
+
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute("INSERT INTO jobs (id, uid, type, params, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                         (job_id, uid, job_type, json.dumps(params or {}), time.time()))
+        finally:
+            conn.close()
+
+        self._dispatch()
+        return self.get(uid, job_id), None
+
+    def get(self, uid, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ? AND uid = ?", (job_id, uid)).fetchone()
+        finally:
+            conn.close()
+        return _job_dict(row, include_result=True) if row else None
+
+    def list(self, uid, limit=50):
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM jobs WHERE uid = ? ORDER BY created_at DESC LIMIT ?",
+                                (uid, limit)).fetchall()
+        finally:
+            conn.close()
+        return [_job_dict(row) for row in rows]
+
+    # Queued jobs are cancelled immediately; running ones stop at their next progress report
+    def cancel(self, uid, job_id):
+        conn = self._connect()
+        try:
+            cur = conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND uid = ? AND status = 'queued'",
+                               (time.time(), job_id, uid))
+            if cur.rowcount:
+                return True, "Job cancelled"
+            cur = conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND uid = ? AND status = 'running'",
+                               (job_id, uid))
+            if cur.rowcount:
+                return True, "Cancellation requested"
+            row = conn.execute("SELECT status FROM jobs WHERE id = ? AND uid = ?", (job_id, uid)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return False, "Job not found"
+        return False, f"Job already {row['status']}"
+
+
+def _job_dict(row, include_result=False):
+    job = {
+        'id': row['id'],
+        'type': row['type'],
+        'status': row['status'],
+        'progress': row['progress'],
+        'message': row['message'],
+        'error': row['error'],
+        'cancel_requested': bool(row['cancel_requested']),
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+    }
+    if include_result:
+        job['result'] = json.loads(row['result']) if row['result'] else None
+    return job
+
+
+# Job handlers: handler(db, uid, params, job) -> JSON-serializable result
+
+def _players_node(db, uid):
+    data = db.child("coach_data").child(uid).child("players").get().val() or {}
+    if isinstance(data, list):
+        data = {str(i): v for i, v in enumerate(data)}
+    return {name: player for name, player in data.items() if isinstance(player, dict)}
+
+def _raw_matches(db, uid, name):
+    data = db.child("coach_data").child(uid).child("players").child(name).child("matches").get().val() or {}
+    if isinstance(data, list):
+        data = {str(i): m for i, m in enumerate(data)}
+    return data
+
+# Recompute every player's totals, optionally re-scoring each match with the current weights first.
+# Firebase gives no transaction here, so each step re-reads just before writing, totals come from a
+# read taken after the efficiency write, and a match deleted in between (which the write would
+# recreate as a bare {"efficiency": ...} stub) is removed again.
+def _rebuild_players(db, uid, job, rescore):
+    names = list((db.child("coach_data").child(uid).child("players").shallow().get().val() or {}))
+    player_count = 0
+    match_count = 0
+    try:
+        for i, name in enumerate(names):
+            job.progress(i / len(names), f"Processing {name}")
+            player_ref = lambda: db.child("coach_data").child(uid).child("players").child(name)
+            role = player_ref().child("role").get().val()
+            if role is None:
+                continue
+
+            if rescore:
+                updates = {}
+                raw_matches = _raw_matches(db, uid, name)
+                for match_id, m in clean_matches(raw_matches).items():
+                    efficiency = compute_efficiency(role, m)
+                    if isinstance(raw_matches[match_id], dict):
+                        updates[f"{match_id}/efficiency"] = efficiency
+                    else:
+                        # Legacy string-encoded match: it can only be rewritten whole
+                        updates[match_id] = dict(m, efficiency=efficiency)
+                if updates:
+                    player_ref().child("matches").update(updates)
+
+            player = player_ref().get().val()
+            if not isinstance(player, dict):
+                continue
+            if "role" not in player:
+                # Player deleted while we wrote; drop what our write recreated
+                player_ref().remove()
+                continue
+            raw_matches = player.get("matches") or {}
+            if isinstance(raw_matches, list):
+                raw_matches = {str(k): m for k, m in enumerate(raw_matches)}
+            stubs = [match_id for match_id, m in raw_matches.items() if isinstance(m, dict) and set(m) == {"efficiency"}]
+            for match_id in stubs:
+                player_ref().child("matches").child(match_id).remove()
+            matches = [m for match_id, m in clean_matches(raw_matches).items() if match_id not in stubs]
+            player_ref().update(summarize_matches(matches))
+            player_count += 1
+            match_count += len(matches)
+    finally:
+        bump_data_version(uid)
+    return {'players': player_count, 'matches': match_count}
+
+def rescore_matches(db, uid, params, job):
+    return _rebuild_players(db, uid, job, rescore=True)
+
+def rebuild_totals(db, uid, params, job):
+    return _rebuild_players(db, uid, job, rescore=False)
+
+# Snapshot of every player with totals and matches
+def export_data(db, uid, params, job):
+    players = _players_node(db, uid)
+    exported = {}
+    for i, (name, player) in enumerate(players.items()):
+        job.progress(i / len(players), f"Exporting {name}")
+        exported[name] = dict(player, matches=clean_matches(player.get("matches")))
+    return {'players': exported}
+
+JOB_TYPES = {
+    'rescore_matches': rescore_matches,
+    'rebuild_totals': rebuild_totals,
+    'export': export_data,
+}
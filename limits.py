@@ -0,0 +1,293 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+from flask import request, session, jsonify
+
+RATE_LIMIT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ratelimits.sqlite3')
+
+# Reverse proxies in front of the app that append to X-Forwarded-For. The 'ip' scope keys on
+# request.remote_addr, so behind a proxy this must be set or every client shares the proxy's
+# bucket. Leave at 0 when clients connect directly, otherwise the header can be spoofed.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+
+# (scope, tokens per second, burst capacity); scope is 'ip', 'coach' or 'email' (the email
+# in the JSON body, so guessing one account's password from many addresses is still capped)
+AUTH_LIMITS = [('ip', 5 / 60, 10)]                      # Registration
+ACCOUNT_LIMITS = AUTH_LIMITS + [('email', 5 / 900, 5)]  # Login and password reset, per IP and per account
+API_LIMITS = [('coach', 10, 30), ('ip', 20, 60)]        # Dashboard and /api routes
+
+# The gate only bounds anything with a threaded worker class (gunicorn --threads N); sync
+# workers handle one request at a time. Threads are safe because request handlers get a
+# fresh pyrebase Database per call (auth.PerCallDatabase).
+MAX_CONCURRENT = 8      # Backend-bound requests in flight per process
+MAX_WAITING = 16        # Requests allowed to queue for a slot before shedding immediately
+QUEUE_TIMEOUT = 2.0     # Seconds a queued request waits for a slot before being shed
+
+BUCKET_TTL = 3600       # Idle buckets older than this are pruned from the shared store
+PRUNE_EVERY = 1000      # Prune after this many takes
+FLUSH_INTERVAL = 5      # Seconds admission counters are buffered per process before hitting the shared store
+
+
+class RateLimiter:
+    # Token buckets keyed by string. With a path the buckets live in SQLite so every
+    # gunicorn worker on the host shares them; without one they stay in process.
+    def __init__(self, path=None):
+        self.path = path
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.takes = 0
+        if path:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            finally:
+                conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        # Buckets are disposable, so skip the fsync on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # Refill then try to spend `cost` tokens; returns (allowed, tokens_left, retry_after_seconds)
+    @staticmethod
+    def _spend(tokens, updated, now, rate, capacity, cost):
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens >= cost:
+            return True, tokens - cost, 0
+        return False, tokens, (cost - tokens) / rate
+
+    def take(self, key, rate, capacity, cost=1):
+        now = time.time()
+        if not self.path:
+            with self.lock:
+                tokens, updated = self.buckets.get(key, (capacity, now))
+                allowed, tokens, retry_after = self._spend(tokens, updated, now, rate, capacity, cost)
+                self.buckets[key] = (tokens, now)
+            return allowed, retry_after
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            allowed, tokens, retry_after = self._spend(tokens, updated, now, rate, capacity, cost)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        with self.lock:
+            self.takes += 1
+            prune = self.takes % PRUNE_EVERY == 0
+        if prune:
+            self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM buckets WHERE updated < ?", (now - BUCKET_TTL,))
+        finally:
+            conn.close()
+
+
+class AdmissionGate:
+    # Bounded concurrency with a bounded wait queue; anything beyond is shed
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_waiting=MAX_WAITING, queue_timeout=QUEUE_TIMEOUT):
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+
+    # Returns None when admitted, otherwise the reason the request was shed
+    def acquire(self):
+        if self.slots.acquire(blocking=False):
+            with self.lock:
+                self.in_flight += 1
+            return None
+
+        with self.lock:
+            if self.waiting >= self.max_waiting:
+                return 'queue_full'
+            self.waiting += 1
+        try:
+            admitted = self.slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        if not admitted:
+            return 'queue_timeout'
+        with self.lock:
+            self.in_flight += 1
+        return None
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+
+class AdmissionMetrics:
+    # Admission counters. With a path they are summed across every gunicorn worker on the
+    # host in SQLite; increments are buffered in process and flushed at most every
+    # FLUSH_INTERVAL seconds (and on snapshot) so counting doesn't add a write per request.
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.last_flush = time.time()
+        if path:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS admission_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            finally:
+                conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            flush = self.path and time.time() - self.last_flush >= FLUSH_INTERVAL
+        if flush:
+            self._flush()
+
+    # Move buffered increments into the shared store; on failure they stay buffered
+    def _flush(self):
+        with self.lock:
+            pending, self.counters = self.counters, {}
+            self.last_flush = time.time()
+        if not pending:
+            return
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("""
+                    INSERT INTO admission_counters (name, value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+                """, pending.items())
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            with self.lock:
+                for name, value in pending.items():
+                    self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        if not self.path:
+            with self.lock:
+                return dict(self.counters)
+
+        self._flush()
+        try:
+            conn = self._connect()
+            try:
+                stats = dict(conn.execute("SELECT name, value FROM admission_counters").fetchall())
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            stats = {}
+        # Anything a failed flush left behind is still only in this process
+        with self.lock:
+            for name, value in self.counters.items():
+                stats[name] = stats.get(name, 0) + value
+        return stats
+
+
+class AdmissionController:
+    # Per-route guard: rate limits first (cheap, 429), then the concurrency gate (503)
+    def __init__(self, limiter, gate, metrics=None):
+        self.limiter = limiter
+        self.gate = gate
+        self.metrics = metrics or AdmissionMetrics()
+
+    def _rate_limited(self, name, limits):
+        for scope, rate, capacity in limits:
+            if scope == 'coach':
+                if not session.get('logged_in'):
+                    continue
+                ident = session.get('uid')
+            elif scope == 'email':
+                data = request.get_json(silent=True)
+                email = data.get('email') if isinstance(data, dict) else None
+                if not isinstance(email, str) or not email.strip():
+                    continue
+                ident = email.strip().lower()
+            else:
+                ident = request.remote_addr
+            try:
+                allowed, retry_after = self.limiter.take(f"{name}:{scope}:{ident}", rate, capacity)
+            except sqlite3.Error:
+                # Fail open: a busy limiter store shouldn't take the site down with it
+                self.metrics.incr('rate_limit_errors')
+                continue
+            if not allowed:
+                self.metrics.incr(f"rate_limited_{name}_{scope}")
+                return retry_after
+        return None
+
+    # `name` keeps separate buckets per limit set, e.g. 'auth' vs 'api'. With `methods`,
+    # requests using any other method (e.g. a GET of the form page) pass straight through.
+    def guard(self, name, limits, methods=None):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if methods and request.method not in methods:
+                    return view(*args, **kwargs)
+
+                retry_after = self._rate_limited(name, limits)
+                if retry_after is not None:
+                    return _reject(429, 'Too many requests. Please slow down.', retry_after)
+
+                reason = self.gate.acquire()
+                if reason:
+                    self.metrics.incr(f"shed_{reason}")
+                    return _reject(503, 'Server is busy. Please try again shortly.', 1)
+
+                self.metrics.incr('admitted')
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.gate.release()
+            return wrapper
+        return decorator
+
+    # Counters are host-wide when the metrics have a store; the gate gauges are always those
+    # of the worker that answered, so they are reported under its pid
+    def snapshot(self):
+        stats = self.metrics.snapshot()
+        with self.gate.lock:
+            stats['process'] = {
+                'pid': os.getpid(),
+                'in_flight': self.gate.in_flight,
+                'waiting': self.gate.waiting,
+            }
+        return stats
+
+
+def _reject(status, message, retry_after):
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
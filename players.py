@@ -74,41 +74,9 @@ def save_match(db, uid, name, match_id, runs, wickets, catches, missed_catches,
 
     # Recalculate player totals from all matches
     all_matches = db.child("coach_data").child(uid).child("players").child(name).child("matches").get().val()
-    if isinstance(all_matches, list):
-        all_matches = {str(i): match for i, match in enumerate(all_matches)}
+    valid_matches = list(clean_matches(all_matches).values())
 
-    valid_matches = []
-    for m in all_matches.values():
-        if isinstance(m, str):
-            try:
-                m = json.loads(m.replace("'", "\""))
-            except:
-                continue
-        if isinstance(m, dict):
-            valid_matches.append(m)
-
-    total_eff = sum(m.get("efficiency", 0) for m in valid_matches)
-    total_runs = sum(m.get("runs", 0) for m in valid_matches)
-    total_wickets = sum(m.get("wickets", 0) for m in valid_matches)
-    total_catches = sum(m.get("catches", 0) for m in valid_matches)
-    total_missed_catches = sum(m.get("missed_catches", 0) for m in valid_matches)
-    total_missed_catches_batsman = sum(m.get("missed_catches_batsman", 0) for m in valid_matches)
-    total_missed_catches_bowler = sum(m.get("missed_catches_bowler", 0) for m in valid_matches)
-    total_overthrows = sum(m.get("overthrows", 0) for m in valid_matches)
-    total_misfields = sum(m.get("misfields", 0) for m in valid_matches)
-    avg_eff = total_eff / len(valid_matches) if valid_matches else 0
-
-    db.child("coach_data").child(uid).child("players").child(name).update({
-        "efficiency": round(avg_eff, 2),
-        "total_runs": total_runs,
-        "total_wickets": total_wickets,
-        "total_catches": total_catches,
-        "total_missed_catches": total_missed_catches,
-        "total_missed_catches_batsman": total_missed_catches_batsman,
-        "total_missed_catches_bowler": total_missed_catches_bowler,
-        "total_overthrows": total_overthrows,
-        "total_misfields": total_misfields
-    })
+    db.child("coach_data").child(uid).child("players").child(name).update(summarize_matches(valid_matches))
     
     return True, "Match added successfully."
 
@@ -116,22 +84,42 @@ def save_match(db, uid, name, match_id, runs, wickets, catches, missed_catches,
 def delete_player(db, uid, name):
     db.child("coach_data").child(uid).child("players").child(name).remove()
 
-# Fetch all matches for a player
-def fetch_matches(db, uid, name):
-    data = db.child("coach_data").child(uid).child("players").child(name).child("matches").get().val() or {}
-
+# Normalize a raw matches node into {match_id: match_dict}, skipping unreadable entries
+def clean_matches(data):
     if isinstance(data, list):
         data = {str(i): v for i, v in enumerate(data)}
 
     cleaned_data = {}
-    for k, v in data.items():
+    for k, v in (data or {}).items():
         if isinstance(v, str):
             try:
                 v = json.loads(v.replace("'", "\""))
-            except:
+            except ValueError:
                 continue
         if isinstance(v, dict):
             cleaned_data[k] = v
+    return cleaned_data
+
+# Player totals and average efficiency over a list of match dicts
+def summarize_matches(matches):
+    total_eff = sum(m.get("efficiency", 0) for m in matches)
+    avg_eff = total_eff / len(matches) if matches else 0
+    return {
+        "efficiency": round(avg_eff, 2),
+        "total_runs": sum(m.get("runs", 0) for m in matches),
+        "total_wickets": sum(m.get("wickets", 0) for m in matches),
+        "total_catches": sum(m.get("catches", 0) for m in matches),
+        "total_missed_catches": sum(m.get("missed_catches", 0) for m in matches),
+        "total_missed_catches_batsman": sum(m.get("missed_catches_batsman", 0) for m in matches),
+        "total_missed_catches_bowler": sum(m.get("missed_catches_bowler", 0) for m in matches),
+        "total_overthrows": sum(m.get("overthrows", 0) for m in matches),
+        "total_misfields": sum(m.get("misfields", 0) for m in matches)
+    }
+
+# Fetch all matches for a player
+def fetch_matches(db, uid, name):
+    data = db.child("coach_data").child(uid).child("players").child(name).child("matches").get().val() or {}
+    cleaned_data = clean_matches(data)
 
     df = pd.DataFrame.from_dict(cleaned_data, orient='index')
     df.index.name = 'match_id'
@@ -140,58 +128,3 @@ def fetch_matches(db, uid, name):
 # Delete a specific match entry
 def delete_match(db, uid, name, match_id):
     db.child("coach_data").child(uid).child("players").child(name).child("matches").child(match_id).remove()
-
-# Update a specific match entry
-def update_match(db, uid, name, match_id, runs, wickets, catches, missed_catches, misfields, balls_faced, fours, sixes, balls_bowled, dot_balls, runs_conceded, strike_rate, economy, efficiency):
-    match_data = {
-        "runs": runs,
-        "wickets": wickets,
-        "catches": catches,
-        "missed_catches": missed_catches,
-        "misfields": misfields,
-        "balls_faced": balls_faced,
-        "fours": fours,
-        "sixes": sixes,
-        "balls_bowled": balls_bowled,
-        "dot_balls": dot_balls,
-        "runs_conceded": runs_conceded,
-        "strike_rate": strike_rate,
-        "economy": economy,
-        "efficiency": efficiency
-    }
-    
-    db.child("coach_data").child(uid).child("players").child(name).child("matches").child(match_id).set(match_data)
-
-    # Recalculate player totals from all matches
-    all_matches = db.child("coach_data").child(uid).child("players").child(name).child("matches").get().val()
-    if isinstance(all_matches, list):
-        all_matches = {str(i): match for i, match in enumerate(all_matches)}
-
-    valid_matches = []
-    for m in all_matches.values():
-        if isinstance(m, str):
-            try:
-                m = json.loads(m.replace("'", "\""))
-            except:
-                continue
-        if isinstance(m, dict):
-            valid_matches.append(m)
-
-    total_eff = sum(m.get("efficiency", 0) for m in valid_matches)
-    total_runs = sum(m.get("runs", 0) for m in valid_matches)
-    total_wickets = sum(m.get("wickets", 0) for m in valid_matches)
-    total_catches = sum(m.get("catches", 0) for m in valid_matches)
-    total_missed_catches = sum(m.get("missed_catches", 0) for m in valid_matches)
-    total_misfields = sum(m.get("misfields", 0) for m in valid_matches)
-    avg_eff = total_eff / len(valid_matches) if valid_matches else 0
-
-    db.child("coach_data").child(uid).child("players").child(name).update({
-        "efficiency": round(avg_eff, 2),
-        "total_runs": total_runs,
-        "total_wickets": total_wickets,
-        "total_catches": total_catches,
-        "total_missed_catches": total_missed_catches,
-        "total_misfields": total_misfields
-    })
-    
-    return True, "Match updated successfully."
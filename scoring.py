@@ -0,0 +1,237 @@
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from players import clean_matches
+from versions import get_data_version
+
+# Match stats that feed the efficiency score, in matrix column order
+STATS = [
+    "runs",
+    "fours",
+    "sixes",
+    "strike_rate",
+    "catches",
+    "wickets",
+    "missed_catches",
+    "missed_catches_batsman",
+    "missed_catches_bowler",
+    "overthrows",
+    "misfields",
+    "dot_balls",
+    "economy",
+]
+
+ROLES = ["Batsman", "Bowler", "All-Rounder"]
+
+# Efficiency weights per role
+ROLE_WEIGHTS = {
+    # Emphasize batting stats for batsmen
+    "Batsman": {
+        "runs": 2.0,                    # Higher weight for runs
+        "fours": 6.0,                   # Higher weight for boundaries
+        "sixes": 8.0,                   # Higher weight for sixes
+        "strike_rate": 1.2,             # Strong emphasis on strike rate
+        "catches": 8.0,                 # Fielding contribution
+        "wickets": 12.0,                # Bonus for bowling wickets
+        "missed_catches": -3.0,         # Penalty for missed catches
+        "missed_catches_batsman": -4.0, # Higher penalty for batsman perspective missed catches
+        "missed_catches_bowler": -2.0,  # Lower penalty for bowler perspective missed catches
+        "overthrows": -3.0,             # Penalty for overthrows
+        "misfields": -2.0,              # Penalty for misfields
+        "dot_balls": -1.0,              # Penalty for dot balls
+        "economy": -0.5,                # Minor penalty for economy (when bowling)
+    },
+    # Emphasize bowling stats for bowlers
+    "Bowler": {
+        "runs": 0.8,                    # Lower weight for batting runs
+        "fours": 2.0,                   # Lower weight for batting boundaries
+        "sixes": 3.0,                   # Lower weight for batting sixes
+        "strike_rate": 0.3,             # Minor batting contribution
+        "catches": 8.0,                 # Good fielding contribution
+        "wickets": 30.0,                # Very high weight for wickets
+        "missed_catches": -5.0,         # Higher penalty for missed catches
+        "missed_catches_batsman": -2.0, # Lower penalty for batsman perspective missed catches
+        "missed_catches_bowler": -6.0,  # Higher penalty for bowler perspective missed catches
+        "overthrows": -5.0,             # Higher penalty for overthrows (bowling perspective)
+        "misfields": -3.0,              # Higher penalty for misfields
+        "dot_balls": -0.5,              # Minor penalty for dot balls when batting
+        "economy": -4.0,                # Strong penalty for high economy rate
+    },
+    # Balanced weight for both batting and bowling
+    "All-Rounder": {
+        "runs": 1.5,                    # Balanced weight for runs
+        "fours": 5.0,                   # Balanced weight for boundaries
+        "sixes": 6.0,                   # Balanced weight for sixes
+        "strike_rate": 0.8,             # Balanced strike rate importance
+        "catches": 8.0,                 # Fielding contribution
+        "wickets": 22.0,                # Balanced weight for wickets
+        "missed_catches": -4.0,         # Penalty for missed catches
+        "missed_catches_batsman": -3.0, # Balanced penalty for batsman perspective missed catches
+        "missed_catches_bowler": -4.0,  # Balanced penalty for bowler perspective missed catches
+        "overthrows": -4.0,             # Balanced penalty for overthrows
+        "misfields": -2.5,              # Penalty for misfields
+        "dot_balls": -0.8,              # Penalty for dot balls
+        "economy": -2.5,                # Balanced penalty for economy
+    },
+}
+
+# Anything that isn't a Batsman or Bowler is scored as an All-Rounder
+def role_key(role):
+    return role if role in ("Batsman", "Bowler") else "All-Rounder"
+
+# Efficiency of a single match for a player of the given role
+def compute_efficiency(role, stats, weights=None):
+    weights = (weights or ROLE_WEIGHTS)[role_key(role)]
+    return sum(weights[s] * float(stats.get(s, 0) or 0) for s in STATS)
+
+# Merge candidate weights over the current ones; returns (weights, error_message)
+def merge_weights(candidate):
+    if not isinstance(candidate, dict):
+        return None, "Weights must be an object keyed by role"
+
+    merged = {role: dict(ROLE_WEIGHTS[role]) for role in ROLES}
+    for role, overrides in candidate.items():
+        if role not in merged:
+            return None, f"Unknown role: {role}"
+        if not isinstance(overrides, dict):
+            return None, f"Weights for {role} must be an object"
+        for stat, value in overrides.items():
+            if stat not in merged[role]:
+                return None, f"Unknown stat for {role}: {stat}"
+            try:
+                weight = float(value)
+            except (TypeError, ValueError):
+                weight = None
+            # NaN/Infinity parse as floats but would make every score NaN (and the JSON invalid)
+            if weight is None or not math.isfinite(weight):
+                return None, f"Weight for {role}.{stat} must be a number"
+            merged[role][stat] = weight
+    return merged, None
+
+def weight_matrix(weights):
+    return np.array([[weights[role][s] for s in STATS] for role in ROLES], dtype=np.float64)
+
+
+class MatchMatrix:
+    # Every stored match of one coach flattened into arrays so a weight set
+    # can be applied to all of them at once
+    def __init__(self, data):
+        if isinstance(data, list):
+            data = {str(i): v for i, v in enumerate(data)}
+
+        self.names = []
+        self.roles = []
+        rows = []
+        owners = []
+        for name, player in (data or {}).items():
+            if not isinstance(player, dict):
+                continue
+            p = len(self.names)
+            self.names.append(name)
+            self.roles.append(player.get("role", ""))
+            for m in clean_matches(player.get("matches")).values():
+                rows.append([float(m.get(s, 0) or 0) for s in STATS])
+                owners.append(p)
+
+        self.stats = np.array(rows, dtype=np.float64).reshape(-1, len(STATS))
+        self.owner = np.array(owners, dtype=np.intp)
+        self.player_roles = np.array([ROLES.index(role_key(r)) for r in self.roles], dtype=np.intp)
+        self.match_roles = self.player_roles[self.owner]
+        self.match_counts = np.bincount(self.owner, minlength=len(self.names))
+
+    # Average match efficiency per player under the given weight set
+    def score(self, weights):
+        w = weight_matrix(weights)
+        per_match = np.einsum('ij,ij->i', self.stats, w[self.match_roles])
+        totals = np.bincount(self.owner, weights=per_match, minlength=len(self.names))
+        counts = np.maximum(self.match_counts, 1)
+        return np.round(totals / counts, 2)
+
+
+# Ranks (1 = best) for an efficiency array, ties broken by name like a stable sort
+def rank_players(names, efficiency):
+    order = np.lexsort((np.array(names, dtype=object), -efficiency))
+    ranks = np.empty(len(names), dtype=np.intp)
+    ranks[order] = np.arange(1, len(names) + 1)
+    return order, ranks
+
+
+SIMULATION_CACHE_SIZE = 256
+
+# Per-coach (version, match matrix) plus an LRU of simulation results keyed by
+# (uid, data version, weights). The shared data version makes writes handled by any
+# worker invalidate every worker's copy.
+_matrices = {}
+_results = OrderedDict()
+_cache_lock = threading.Lock()
+
+def get_match_matrix(db, uid, version):
+    with _cache_lock:
+        cached = _matrices.get(uid)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    data = db.child("coach_data").child(uid).child("players").get().val() or {}
+    matrix = MatchMatrix(data)
+    with _cache_lock:
+        cached = _matrices.get(uid)
+        if cached is None or cached[0] < version:
+            _matrices[uid] = (version, matrix)
+            # Results from older versions of this coach's data can never be hit again
+            for key in [k for k in _results if k[0] == uid and k[1] != version]:
+                del _results[key]
+        return _matrices[uid][1]
+
+def _weights_key(weights):
+    return tuple(tuple(weights[role][s] for s in STATS) for role in ROLES)
+
+# Re-score every stored match of a coach with candidate weights and compare to the current ones
+def simulate_weights(db, uid, candidate):
+    weights, error = merge_weights(candidate)
+    if error:
+        return None, error
+
+    # Read the version before the data so a write racing the load isn't cached as current
+    version = get_data_version(uid)
+    key = (uid, version, _weights_key(weights))
+    with _cache_lock:
+        if key in _results:
+            _results.move_to_end(key)
+            return _results[key], None
+
+    matrix = get_match_matrix(db, uid, version)
+    current_eff = matrix.score(ROLE_WEIGHTS)
+    simulated_eff = matrix.score(weights)
+    current_order, current_ranks = rank_players(matrix.names, current_eff)
+    simulated_order, simulated_ranks = rank_players(matrix.names, simulated_eff)
+
+    rankings = []
+    for i in simulated_order:
+        rankings.append({
+            'name': matrix.names[i],
+            'role': matrix.roles[i],
+            'matches': int(matrix.match_counts[i]),
+            'current_efficiency': float(current_eff[i]),
+            'simulated_efficiency': float(simulated_eff[i]),
+            'current_rank': int(current_ranks[i]),
+            'simulated_rank': int(simulated_ranks[i]),
+            'rank_delta': int(current_ranks[i] - simulated_ranks[i]),
+        })
+
+    current_xi = [matrix.names[i] for i in current_order[:11]]
+    simulated_xi = [matrix.names[i] for i in simulated_order[:11]]
+    result = {
+        'weights': weights,
+        'rankings': rankings,
+        'current_team': current_xi,
+        'simulated_team': simulated_xi,
+        'team_in': [n for n in simulated_xi if n not in current_xi],
+        'team_out': [n for n in current_xi if n not in simulated_xi],
+    }
+
+    with _cache_lock:
+        _results[key] = result
+        while len(_results) > SIMULATION_CACHE_SIZE:
+            _results.popitem(last=False)
+    return result, None
@@ -0,0 +1,189 @@
+import threading
+import numpy as np
+from players import clean_matches
+from versions import get_changed_players, get_data_version
+
+# Player totals taken straight from fetch_players
+TOTAL_FEATURES = [
+    "efficiency",
+    "total_runs",
+    "total_wickets",
+    "total_catches",
+    "total_missed_catches",
+    "total_overthrows",
+    "total_misfields",
+]
+
+# Per-match averages over the match fields fetch_matches exposes
+MATCH_FEATURES = [
+    "runs",
+    "wickets",
+    "catches",
+    "balls_faced",
+    "fours",
+    "sixes",
+    "balls_bowled",
+    "dot_balls",
+    "runs_conceded",
+    "strike_rate",
+    "economy",
+]
+
+FEATURES = TOTAL_FEATURES + ["matches_played"] + ["avg_" + f for f in MATCH_FEATURES]
+
+# Build the raw (un-normalized) feature row for one player from its stored node
+def build_feature_vector(player):
+    matches = list(clean_matches(player.get("matches")).values())
+    row = [float(player.get(f, 0) or 0) for f in TOTAL_FEATURES]
+    row.append(float(len(matches)))
+    if matches:
+        per_match = np.array([[float(m.get(f, 0) or 0) for f in MATCH_FEATURES] for m in matches])
+        row.extend(per_match.mean(axis=0))
+    else:
+        row.extend([0.0] * len(MATCH_FEATURES))
+    return np.array(row, dtype=np.float64)
+
+
+class PlayerIndex:
+    # Raw stat rows for every player of one coach, kept in a growable NumPy matrix.
+    # Rows are swapped-and-popped on removal so the live block is always [:size].
+    def __init__(self, capacity=64):
+        self.matrix = np.zeros((capacity, len(FEATURES)), dtype=np.float64)
+        self.names = []
+        self.roles = []
+        self.rows = {}
+        self.lock = threading.Lock()
+        # Held while catching up so concurrent queries don't replay the same changes
+        self.sync_lock = threading.Lock()
+        self.version = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def upsert(self, name, role, vector):
+        with self.lock:
+            row = self.rows.get(name)
+            if row is None:
+                row = len(self.names)
+                if row == self.matrix.shape[0]:
+                    grown = np.zeros((row * 2, len(FEATURES)), dtype=np.float64)
+                    grown[:row] = self.matrix
+                    self.matrix = grown
+                self.names.append(name)
+                self.roles.append(role)
+                self.rows[name] = row
+            else:
+                self.roles[row] = role
+            self.matrix[row] = vector
+
+    def remove(self, name):
+        with self.lock:
+            row = self.rows.pop(name, None)
+            if row is None:
+                return
+            last = len(self.names) - 1
+            if row != last:
+                self.matrix[row] = self.matrix[last]
+                self.names[row] = self.names[last]
+                self.roles[row] = self.roles[last]
+                self.rows[self.names[row]] = row
+            self.names.pop()
+            self.roles.pop()
+
+    # k nearest players to `name` by cosine similarity of z-scored features
+    def nearest(self, name, k=5, role=None):
+        with self.lock:
+            row = self.rows.get(name)
+            if row is None:
+                return None
+            size = len(self.names)
+            data = self.matrix[:size]
+            names = list(self.names)
+            roles = np.array(self.roles, dtype=object)
+
+            std = data.std(axis=0)
+            std[std == 0] = 1.0
+            z = (data - data.mean(axis=0)) / std
+            norms = np.linalg.norm(z, axis=1)
+            norms[norms == 0] = 1.0
+            z /= norms[:, None]
+
+        scores = z @ z[row]
+        candidates = np.ones(size, dtype=bool)
+        candidates[row] = False
+        if role:
+            candidates &= roles == role
+        idx = np.flatnonzero(candidates)
+        if idx.size == 0:
+            return []
+        k = min(k, idx.size)
+        top = idx[np.argpartition(-scores[idx], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {'name': names[i], 'role': roles[i], 'similarity': round(float(scores[i]), 4)}
+            for i in top
+        ]
+
+
+# One index per coach, built lazily on first query. When the coach's shared data version
+# moves on (e.g. after a write handled by another worker) the index catches up from the
+# version change log, re-reading only the players that changed; it is rebuilt from scratch
+# only when the log has a gap or the change set is large.
+MAX_CATCH_UP_PLAYERS = 32
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _player_node(db, uid, name):
+    return db.child("coach_data").child(uid).child("players").child(name).get().val()
+
+# Bring `index` up to `version` in place; returns False if it has to be rebuilt instead
+def _catch_up(db, uid, index, version):
+    with index.sync_lock:
+        if index.version >= version:
+            return True
+        changed = get_changed_players(uid, index.version, version)
+        if changed is None or len(changed) > MAX_CATCH_UP_PLAYERS:
+            return False
+        for name in changed:
+            player = _player_node(db, uid, name)
+            if isinstance(player, dict):
+                index.upsert(name, player.get("role", ""), build_feature_vector(player))
+            else:
+                index.remove(name)
+        index.version = version
+        return True
+
+def _build_index(db, uid, version):
+    # One read of the whole players node instead of a fetch_matches round trip per player
+    data = db.child("coach_data").child(uid).child("players").get().val() or {}
+    if isinstance(data, list):
+        data = {str(i): v for i, v in enumerate(data)}
+
+    index = PlayerIndex(capacity=max(64, len(data)))
+    index.version = version
+    for name, player in data.items():
+        if isinstance(player, dict):
+            index.upsert(name, player.get("role", ""), build_feature_vector(player))
+    return index
+
+def get_index(db, uid):
+    # Read the version before the data so a write racing the load is replayed on the next query
+    version = get_data_version(uid)
+    with _indexes_lock:
+        index = _indexes.get(uid)
+    if index is not None and index.version == version:
+        return index
+    if index is not None and index.version < version and _catch_up(db, uid, index, version):
+        return index
+
+    index = _build_index(db, uid, version)
+    with _indexes_lock:
+        current = _indexes.get(uid)
+        if current is None or current.version < version:
+            _indexes[uid] = index
+        return _indexes[uid]
+
+# Find the k players most like `name`, optionally restricted to one role
+def find_similar_players(db, uid, name, k=5, role=None):
+    return get_index(db, uid).nearest(name, k, role)
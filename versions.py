@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import threading
+
+# Per-coach data version shared by every app process on the host. Writers bump it after
+# changing a coach's players or matches; in-process caches remember the version they were
+# built from and rebuild when it no longer matches. Each bump also logs which players it
+# touched so a stale cache can catch up by re-reading just those.
+DATA_VERSIONS_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'versions.sqlite3')
+
+CHANGE_LOG_VERSIONS = 1000    # Versions of change log kept per coach; older gaps force a rebuild
+
+_init_lock = threading.Lock()
+_initialized = False
+
+def _connect():
+    global _initialized
+    conn = sqlite3.connect(DATA_VERSIONS_DB_PATH, timeout=30, isolation_level=None)
+    if not _initialized:
+        with _init_lock:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS data_versions (uid TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            # player is NULL when the version may have touched any player (e.g. a full rebuild)
+            conn.execute("CREATE TABLE IF NOT EXISTS data_changes (uid TEXT NOT NULL, version INTEGER NOT NULL, player TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS data_changes_uid_version ON data_changes (uid, version)")
+            _initialized = True
+    return conn
+
+def get_data_version(uid):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT version FROM data_versions WHERE uid = ?", (uid,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
+# Record that a coach's data changed; returns the new version. `players` names the players
+# whose nodes were written (old and new name for a rename); None means any of them may have.
+def bump_data_version(uid, players=None):
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            INSERT INTO data_versions (uid, version) VALUES (?, 1)
+            ON CONFLICT(uid) DO UPDATE SET version = version + 1
+        """, (uid,))
+        version = conn.execute("SELECT version FROM data_versions WHERE uid = ?", (uid,)).fetchone()[0]
+        changed = set(players) if players is not None else {None}
+        conn.executemany("INSERT INTO data_changes (uid, version, player) VALUES (?, ?, ?)",
+                         [(uid, version, name) for name in changed])
+        conn.execute("DELETE FROM data_changes WHERE uid = ? AND version <= ?", (uid, version - CHANGE_LOG_VERSIONS))
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return version
+
+# Players changed by versions (since, until]; None if the log can't say (a version is
+# missing from it or touched every player), in which case the caller must rebuild
+def get_changed_players(uid, since, until):
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT version, player FROM data_changes WHERE uid = ? AND version > ? AND version <= ?",
+                            (uid, since, until)).fetchall()
+    finally:
+        conn.close()
+    if len({version for version, _ in rows}) != until - since:
+        return None
+    players = {player for _, player in rows}
+    if None in players:
+        return None
+    return players